@@ -18,17 +18,27 @@ import logging
 import os
 import re
 import shutil
+import stat
 
 from guild import util
 
 log = logging.getLogger("guild")
 
+DIGEST_BUF_SIZE = 4 * 1024 * 1024
+
+FILES_DIFFER_BUF_SIZE = 1024 * 1024
+
+COPY_BUF_SIZE = 1024 * 1024
+
 
 class FileSelect:
     def __init__(self, root, rules):
         self.root = root
         self.rules = rules
+        self._file_rules = [rule for rule in rules or [] if rule.type != "dir"]
+        self._dir_rules = [rule for rule in rules or [] if rule.type == "dir"]
         self._disabled = None
+        self._short_circuit = None
 
     @property
     def disabled(self):
@@ -57,33 +67,67 @@ class FileSelect:
     def select_file(self, src_root, relpath):
         """Apply rules to file located under src_root with relpath.
 
-        All rules are applied to the file. The last rule to apply
-        (i.e. its `test` method returns a non-None value) determines
-        whether or not the file is selected - selected if test returns
-        True, not selected if returns False.
+        Rules are applied to the file in reverse order. The last rule
+        to apply (i.e. its `test` method returns a non-None value)
+        determines whether or not the file is selected - selected if
+        test returns True, not selected if returns False. Rules
+        preceding the determining rule are not applied unless a rule
+        limits its number of matches, in which case all rules are
+        applied to maintain match counts.
 
         If no rules return a non-None value, the file is not selected.
 
         Returns a tuple of the selected flag (True or False) and list
-        of applied rules and their results (two-tuples).
+        of applied rules and their results (two-tuples) in rule order.
         """
-        rule_results = [
-            (rule.test(src_root, relpath), rule)
-            for rule in self.rules
-            if rule.type != "dir"
-        ]
+        # Cache of file attributes shared across rules for relpath
+        context = {}
+        if self._can_short_circuit():
+            rule_results = self._short_circuit_rule_results(
+                src_root, relpath, context
+            )
+        else:
+            rule_results = self._all_rule_results(src_root, relpath, context)
         result, _test = reduce_file_select_results(rule_results)
         return result is True, rule_results
 
-    def prune_dirs(self, src_root, relroot, dirs):
+    def _can_short_circuit(self):
+        if self._short_circuit is None:
+            self._short_circuit = not any(
+                rule.max_matches is not None for rule in self.rules or []
+            )
+        return self._short_circuit
+
+    def _short_circuit_rule_results(self, src_root, relpath, context):
+        rule_results = []
+        for rule in reversed(self._file_rules):
+            rule_result = rule.test(src_root, relpath, context)
+            rule_results.append((rule_result, rule))
+            if rule_result[0] is not None:
+                break
+        rule_results.reverse()
+        return rule_results
+
+    def _all_rule_results(self, src_root, relpath, context):
+        return [
+            (rule.test(src_root, relpath, context), rule)
+            for rule in self._file_rules
+        ]
+
+    def prune_dirs(self, src_root, relroot, dirs, sort=True):
+        """Removes directories from dirs that are excluded by dir rules.
+
+        Returns a list of removed directory names. Dirs are evaluated
+        in sorted order unless `sort` is False.
+        """
+        if not self._dir_rules:
+            return []
         pruned = []
-        for name in sorted(dirs):
+        for name in sorted(dirs) if sort else list(dirs):
             last_rule_result = None
             relpath = os.path.join(relroot, name)
-            for rule in self.rules:
-                if rule.type != "dir":
-                    continue
-                rule_result, _test = rule.test(src_root, relpath)
+            for rule in self._dir_rules:
+                rule_result, _test = rule.test_dir(src_root, relpath)
                 if rule_result is not None:
                     last_rule_result = rule_result
             if last_rule_result is False:
@@ -102,9 +146,9 @@ def reduce_file_select_results(results):
 
     Returns a tuple of result and determining-test.
     """
-    for (result, test), _rule in reversed(results):
-        if result is not None:
-            return result, test
+    for rule_result, _rule in reversed(results):
+        if rule_result[0] is not None:
+            return rule_result
     return None, None
 
 
@@ -116,6 +160,12 @@ class DisabledFileSelect(FileSelect):
     def disabled(self):
         return True
 
+    def select_file(self, src_root, relpath):
+        return False, []
+
+    def prune_dirs(self, src_root, relroot, dirs, sort=True):
+        return []
+
 
 class FileSelectRule:
     def __init__(
@@ -180,7 +230,8 @@ class FileSelectRule:
 
     @staticmethod
     def _fnmatch_f(patterns):
-        return lambda path: any((_fnmatch(path, p) for p in patterns))
+        compiled = [_compile_fnmatch(p) for p in patterns]
+        return lambda path: any((_fnmatch(path, p) for p in compiled))
 
     @staticmethod
     def _validate_type(type):
@@ -195,18 +246,42 @@ class FileSelectRule:
     def matches(self):
         return self._matches
 
-    def test(self, src_root, relpath):
+    def test(self, src_root, relpath, context=None):
         """Returns a tuple of result and applicable test.
 
         Applicable test can be used as a reason for the result -
         e.g. to provide details to a user on why a particular file was
         selected or not.
+
+        `context` is an optional dict used to cache file attributes
+        read by a test (e.g. file type and size) so they can be reused
+        when testing the same file with other rules.
+        """
+        fullpath = os.path.join(src_root, relpath)
+        tests = [
+            FileSelectTest("max matches", self._test_max_matches),
+            FileSelectTest("pattern", self._test_patterns, relpath),
+            FileSelectTest("type", self._test_type, fullpath, context),
+            FileSelectTest("size", self._test_size, fullpath, context),
+        ]
+        for test in tests:
+            if not test():
+                return None, test
+        self._matches += 1
+        return self.result, None
+
+    def test_dir(self, src_root, relpath):
+        """Returns a tuple of result and applicable test for a directory.
+
+        Use in place of `test` when relpath is known to be a directory
+        under src_root. The type test is skipped in favor of a test
+        for the rule sentinel, if any.
         """
         fullpath = os.path.join(src_root, relpath)
         tests = [
             FileSelectTest("max matches", self._test_max_matches),
             FileSelectTest("pattern", self._test_patterns, relpath),
-            FileSelectTest("type", self._test_type, fullpath),
+            FileSelectTest("sentinel", self._test_sentinel, fullpath),
             FileSelectTest("size", self._test_size, fullpath),
         ]
         for test in tests:
@@ -223,36 +298,39 @@ class FileSelectRule:
     def _test_patterns(self, path):
         return self._patterns_match(path)
 
-    def _test_type(self, path):
+    def _test_type(self, path, context=None):
         if self.type is None:
             return True
         if self.type == "text":
-            return self._test_text_file(path)
+            return self._test_text_file(path, context)
         if self.type == "binary":
-            return self._test_binary_file(path)
+            return self._test_binary_file(path, context)
         if self.type == "dir":
-            return self._test_dir(path)
+            return self._test_dir(path, context)
         assert False, self.type
 
     @staticmethod
-    def _test_text_file(path):
-        return util.safe_is_text_file(path)
+    def _test_text_file(path, context=None):
+        return _file_attr("text", util.safe_is_text_file, path, context)
 
     @staticmethod
-    def _test_binary_file(path):
-        return not util.safe_is_text_file(path)
+    def _test_binary_file(path, context=None):
+        return not _file_attr("text", util.safe_is_text_file, path, context)
 
-    def _test_dir(self, path):
-        if not os.path.isdir(path):
+    def _test_dir(self, path, context=None):
+        if not _file_attr("dir", os.path.isdir, path, context):
             return False
+        return self._test_sentinel(path)
+
+    def _test_sentinel(self, path):
         if self.sentinel:
             return glob.glob(os.path.join(path, self.sentinel))
         return True
 
-    def _test_size(self, path):
+    def _test_size(self, path, context=None):
         if self.size_gt is None and self.size_lt is None:
             return True
-        size = util.safe_filesize(path)
+        size = _file_attr("size", util.safe_filesize, path, context)
         if size is None:
             return True
         if self.size_gt and size > self.size_gt:
@@ -262,6 +340,18 @@ class FileSelectRule:
         return False
 
 
+def _file_attr(name, f, path, context):
+    """Returns `f(path)` using context as an optional cache."""
+    if context is None:
+        return f(path)
+    key = (name, path)
+    try:
+        return context[key]
+    except KeyError:
+        val = context[key] = f(path)
+        return val
+
+
 def _quote_pattern(p):
     return util.shlex_quote(p) if " " in p else p
 
@@ -270,19 +360,28 @@ def _native_paths(patterns):
     return [p.replace("/", os.path.sep) for p in patterns]
 
 
-def _fnmatch(path, pattern):
-    if os.path.sep not in pattern:
+def _compile_fnmatch(pattern):
+    """Returns a tuple of compiled match function and basename flag.
+
+    Patterns are translated to regular expressions once when the rule
+    is created rather than each time a path is tested. Basename flag
+    is True when the pattern should be applied to a path basename
+    rather than the full path.
+    """
+    match_basename = os.path.sep not in pattern
+    pattern = os.path.normcase(_strip_leading_path_sep(pattern))
+    return re.compile(fnmatch.translate(pattern)).match, match_basename
+
+
+def _fnmatch(path, compiled):
+    match, match_basename = compiled
+    if match_basename:
         path = os.path.basename(path)
-    pattern = _strip_leading_path_sep(pattern)
-    return fnmatch.fnmatch(path, pattern)
+    return match(os.path.normcase(path)) is not None
 
 
 def _strip_leading_path_sep(pattern):
-    while pattern:
-        if pattern[0] != os.path.sep:
-            break
-        pattern = pattern[1:]
-    return pattern
+    return pattern.lstrip(os.path.sep)
 
 
 class FileSelectTest:
@@ -318,8 +417,7 @@ class FileCopyHandler:
 
     def _try_copy_file(self, src, dest):
         try:
-            shutil.copyfile(src, dest)
-            shutil.copymode(src, dest)
+            _copyfile(src, dest)
         except IOError as e:
             if e.errno != 2:  # Ignore file not exists
                 if not self.handle_copy_error(e, src, dest):
@@ -338,6 +436,66 @@ class FileCopyHandler:
         pass
 
 
+def _copyfile(src, dest):
+    """Copies src to dest along with src file mode.
+
+    Uses `os.copy_file_range` when available to copy regular file
+    contents within the kernel. Falls back on `shutil.copyfileobj` if
+    the platform or file system does not support it. Other file types
+    are copied using `shutil.copyfile`.
+    """
+    if _samefile(src, dest):
+        raise shutil.SameFileError(f"{src!r} and {dest!r} are the same file")
+    st = os.stat(src)
+    if not stat.S_ISREG(st.st_mode):
+        # Defer to shutil for special file handling (e.g. named pipes)
+        shutil.copyfile(src, dest)
+        os.chmod(dest, stat.S_IMODE(st.st_mode))
+        return
+    with open(src, "rb") as f_src, open(dest, "wb") as f_dest:
+        if not _try_copy_file_range(f_src, f_dest, st.st_size):
+            shutil.copyfileobj(f_src, f_dest, COPY_BUF_SIZE)
+    os.chmod(dest, stat.S_IMODE(st.st_mode))
+
+
+def _samefile(src, dest):
+    try:
+        return os.path.samefile(src, dest)
+    except OSError:
+        return False
+
+
+def _try_copy_file_range(f_src, f_dest, size):
+    """Copies size bytes from f_src to f_dest using `copy_file_range`.
+
+    Returns True if the file was copied, otherwise returns False to
+    indicate that the caller should copy using another method. Errors
+    that occur after bytes are copied are raised.
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if not copy_file_range or not size:
+        # Some files report a zero size but have content (e.g. files
+        # under /proc)
+        return False
+    src_fd = f_src.fileno()
+    dest_fd = f_dest.fileno()
+    copied = 0
+    while copied < size:
+        try:
+            n = copy_file_range(src_fd, dest_fd, size - copied)
+        except OSError:
+            if copied:
+                raise
+            return False
+        if n == 0:
+            if not copied:
+                # Some file systems don't copy and return 0 - fall back
+                return False
+            break
+        copied += n
+    return True
+
+
 def copyfiles(src, dest, files, handler_cls=None):
     # Opportunistic use of FileCopyHandler to copy files. `unused_xxx`
     # vars below signal that we're explicitly not using parts of the
@@ -356,6 +514,8 @@ def copytree(
     followlinks=True,
     ignore=None,
     handler_cls=None,
+    parallel=None,
+    sort=True,
 ):
     """Copies files to dest for a FileSelect.
 
@@ -378,32 +538,71 @@ def copytree(
     class is specified, the handler is still instantiated, however, no
     calls to `copy()` or `ignore()` will be made.
 
+    `parallel` is an optional number of threads used to copy
+    files. By default files are copied serially. When `parallel` is
+    specified, handler `copy()` is called from worker threads and must
+    be thread safe. Calls to `ignore()` are always made from the
+    calling thread.
+
+    If sort is True (the default), directories and files are evaluated
+    in sorted order. Set sort to False to evaluate them in the order
+    listed by the file system. Note that order affects which files are
+    selected by rules that limit matches.
+
     """
     src = _copytree_src(root_start, select)
     # Instantiate handler as part of the copytree contract.
     handler = (handler_cls or FileCopyHandler)(src, dest, select)
+    if select.disabled:
+        handler.close()
+        return
     try:
-        _copytree_impl(src, select, followlinks, ignore, handler)
+        if parallel:
+            _copytree_parallel(
+                src, select, followlinks, ignore, handler, parallel, sort
+            )
+        else:
+            _copytree_impl(src, select, followlinks, ignore, handler, sort=sort)
     finally:
         handler.close()
 
 
-def _copytree_impl(src, select, followlinks, ignore, copy_handler):
-    if select.disabled:
-        return
+def _copytree_parallel(
+    src, select, followlinks, ignore, copy_handler, workers, sort
+):
+    from concurrent.futures import ThreadPoolExecutor
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def copy(relpath, results):
+            futures.append(executor.submit(copy_handler.copy, relpath, results))
+
+        _copytree_impl(src, select, followlinks, ignore, copy_handler, copy, sort)
+    # Raise any error from a copy
+    for future in futures:
+        future.result()
+
+
+def _copytree_impl(
+    src, select, followlinks, ignore, copy_handler, copy=None, sort=True
+):
+    copy = copy or copy_handler.copy
     ignore = set(ignore or [])
     for root, dirs, files in os.walk(src, followlinks=followlinks):
-        dirs.sort()
+        if sort:
+            dirs.sort()
+            files.sort()
         relroot = _relpath(root, src)
-        pruned = select.prune_dirs(src, relroot, dirs)
+        pruned = select.prune_dirs(src, relroot, dirs, sort)
         for name in pruned:
             relpath = os.path.join(relroot, name)
             copy_handler.ignore(relpath, [])
-        for name in sorted(files):
+        for name in files:
             relpath = os.path.join(relroot, name)
             selected, results = _select_file_to_copy(src, relpath, select, ignore)
             if selected:
-                copy_handler.copy(relpath, results)
+                copy(relpath, results)
             else:
                 copy_handler.ignore(relpath, results)
 
@@ -441,17 +640,32 @@ def _relpath(path, start):
 
 def disk_usage(path):
     total = _file_size(path)
-    for root, dirs, names in os.walk(path, followlinks=False):
-        for name in dirs + names:
-            path = os.path.join(root, name)
-            total += _file_size(os.path.join(root, name))
+    dirs = [path]
+    while dirs:
+        try:
+            entries = os.scandir(dirs.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                total += _entry_size(entry)
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
     return total
 
 
+def _entry_size(entry):
+    try:
+        return entry.stat(follow_symlinks=False).st_size
+    except OSError as e:
+        log.warning("could not read size of %s: %s", entry.path, e)
+        return 0
+
+
 def _file_size(path):
-    stat = os.lstat if os.path.islink(path) else os.stat
+    stat_f = os.lstat if os.path.islink(path) else os.stat
     try:
-        return stat(path).st_size
+        return stat_f(path).st_size
     except (OSError, IOError) as e:
         log.warning("could not read size of %s: %s", path, e)
         return 0
@@ -459,16 +673,30 @@ def _file_size(path):
 
 def find(root, followlinks=False, includedirs=False, unsorted=False):
     paths = []
-
-    def relpath(path, name):
-        return os.path.relpath(os.path.join(path, name), root)
-
-    for path, dirs, files in os.walk(root, followlinks=followlinks):
-        for name in dirs:
-            if includedirs or os.path.islink(os.path.join(path, name)):
-                paths.append(relpath(path, name))
-        for name in files:
-            paths.append(relpath(path, name))
+    # Stack of dirs to scan as tuples of path and relpath prefix
+    dirs = [(root, "")]
+    while dirs:
+        path, prefix = dirs.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            continue
+        subdirs = []
+        files = []
+        with entries:
+            for entry in entries:
+                relpath = prefix + entry.name
+                if util.safe_is_dir(entry):
+                    is_link = entry.is_symlink()
+                    if includedirs or is_link:
+                        paths.append(relpath)
+                    if followlinks or not is_link:
+                        subdirs.append((entry.path, relpath + os.path.sep))
+                else:
+                    files.append(relpath)
+        paths.extend(files)
+        # Reverse subdirs to scan them in the order they were listed
+        dirs.extend(reversed(subdirs))
     return paths if unsorted else sorted(paths)
 
 
@@ -507,8 +735,8 @@ def files_differ(path1, path2):
     f2 = open(path2, "rb")
     with f1, f2:
         while True:
-            buf1 = f1.read(1024)
-            buf2 = f2.read(1024)
+            buf1 = f1.read(FILES_DIFFER_BUF_SIZE)
+            buf2 = f2.read(FILES_DIFFER_BUF_SIZE)
             if buf1 != buf2:
                 return True
             if not buf1 or not buf2:
@@ -516,17 +744,35 @@ def files_differ(path1, path2):
     return False
 
 
-def files_digest(paths, root_dir):
+def files_digest(paths, root_dir, algo="md5"):
+    """Returns a hex digest for a list of files under root_dir.
+
+    `algo` is the name of a hash algorithm supported by
+    `hashlib.new()`. The default algorithm is `md5`, which is used for
+    source code digests and should not be changed for that purpose.
+    """
+    return files_fingerprint(paths, root_dir, algo).hexdigest()
+
+
+def files_fingerprint(paths, root_dir, algo="md5", buf_size=DIGEST_BUF_SIZE):
+    """Returns a hash object for a list of files under root_dir.
+
+    Use to obtain both the hex digest and the raw digest of files in a
+    single pass (e.g. to compare with a stored binary digest). File
+    contents are read in chunks of `buf_size` into a single reusable
+    buffer.
+    """
     import hashlib
 
-    md5 = hashlib.md5()
+    d = hashlib.new(algo)
+    buf = bytearray(buf_size)
     for path in paths:
         normpath = _path_for_digest(path)
-        md5.update(_encode_file_path_for_digest(normpath))
-        md5.update(b"\x00")
-        _apply_digest_file_bytes(os.path.join(root_dir, path), md5)
-        md5.update(b"\x00")
-    return md5.hexdigest()
+        d.update(_encode_file_path_for_digest(normpath))
+        d.update(b"\x00")
+        _apply_digest_file_bytes(os.path.join(root_dir, path), d, buf)
+        d.update(b"\x00")
+    return d
 
 
 def _path_for_digest(path):
@@ -537,11 +783,12 @@ def _encode_file_path_for_digest(path):
     return path.encode("UTF-8")
 
 
-def _apply_digest_file_bytes(path, d):
-    buf_size = 1024 * 1024
-    with open(path, "rb") as f:
+def _apply_digest_file_bytes(path, d, buf):
+    # Read into a reusable buffer to avoid allocating per chunk
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
         while True:
-            buf = f.read(buf_size)
-            if not buf:
+            n = f.readinto(buf)
+            if not n:
                 break
-            d.update(buf)
+            d.update(view[:n])
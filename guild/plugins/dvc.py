@@ -22,6 +22,7 @@
 import copy
 import logging
 import os
+import stat
 
 from guild import config
 from guild import guildfile
@@ -36,6 +37,9 @@ from . import dvc_util
 
 log = logging.getLogger("guild")
 
+_dvc_modeldef_cache = {}
+_dvc_yaml_hash_cache = {}
+
 
 class DvcModelProxy:
     name = "dvc.yaml"
@@ -46,6 +50,44 @@ class DvcModelProxy:
 
 
 def _init_dvc_modeldef(model_name, stage_name, project_dir):
+    """Returns the model def for a DvC stage.
+
+    Model defs are cached and reloaded when dvc.yaml or any of the
+    stage params files change. As with Guild files, cached model defs
+    are shared and must not be modified by callers.
+    """
+    cache_key = model_name, stage_name, project_dir
+    stamp = _dvc_modeldef_stamp(stage_name, project_dir)
+    cached = _dvc_modeldef_cache.get(cache_key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    modeldef = _load_dvc_modeldef(model_name, stage_name, project_dir)
+    _dvc_modeldef_cache[cache_key] = stamp, modeldef
+    return modeldef
+
+
+def _dvc_modeldef_stamp(stage_name, project_dir):
+    dvc_config = dvc_util.load_dvc_config(project_dir)
+    params_files = {
+        filename
+        for _param, filename in dvc_util.iter_stage_params(stage_name, dvc_config)
+    }
+    paths = [dvc_util.dvc_yaml_path(project_dir)] + [
+        os.path.join(project_dir, filename) for filename in sorted(params_files)
+    ]
+    return tuple(_file_stamp(path) for path in paths)
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    else:
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _load_dvc_modeldef(model_name, stage_name, project_dir):
     data = [
         {
             "model": model_name,
@@ -143,13 +185,26 @@ def _apply_config_flags(gf, model_name, op_name):
 
 def _init_dvc_model_reference(project_dir):
     dvc_yaml_path = os.path.join(project_dir, "dvc.yaml")
-    if os.path.isfile(dvc_yaml_path):
-        version = modellib.file_hash(dvc_yaml_path)
-    else:
-        version = "unknown"
+    version = _dvc_yaml_hash(dvc_yaml_path)
     return modellib.ModelRef("import", dvc_yaml_path, version, "dvc.yaml")
 
 
+def _dvc_yaml_hash(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "unknown"
+    if not stat.S_ISREG(st.st_mode):
+        return "unknown"
+    stamp = st.st_ino, st.st_mtime_ns, st.st_size
+    cached = _dvc_yaml_hash_cache.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    version = modellib.file_hash(path)
+    _dvc_yaml_hash_cache[path] = stamp, version
+    return version
+
+
 class Stage:
     def __init__(self, name, config, project_dir):
         self.name = name
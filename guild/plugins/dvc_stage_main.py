@@ -14,12 +14,13 @@
 
 import argparse
 
+from concurrent.futures import ThreadPoolExecutor
+import errno
 import logging
 import os
+import stat
 import subprocess
 
-import yaml
-
 from guild import op_util
 
 from guild import run as runlib
@@ -61,8 +62,7 @@ def _required_run_dir():
 
 
 def _load_dvc_yaml(dir):
-    with open(os.path.join(dir, "dvc.yaml")) as f:
-        return yaml.safe_load(f)
+    return dvc_util.load_dvc_config(dir)
 
 
 def main():
@@ -203,34 +203,36 @@ def _dep_entry_for_op_link(dep, state):
 
 
 def _resolve_project_deps(deps, state):
+    copies = []
+    pulls = []
     for dep in deps:
-        if _is_project_file(dep, state):
-            _copy_or_link_project_file(dep, state)
+        dep_path = os.path.join(state.project_dir, dep)
+        dep_stat = _project_file_stat(dep_path)
+        if dep_stat is None:
+            pulls.append(dep)
+        elif stat.S_ISREG(dep_stat.st_mode):
+            _copy_project_file(dep_path, dep, state, copies)
         else:
-            _pull_dep(dep, state)
-
-
-def _is_project_file(dep, state):
-    path = os.path.join(state.project_dir, dep)
-    return os.path.exists(path)
+            _link_project_file(dep_path, dep, state)
+    _copy_files(copies, link=_link_deps_enabled())
+    _pull_deps(pulls, state)
 
 
-def _copy_or_link_project_file(dep, state):
-    dep_path = os.path.join(state.project_dir, dep)
-    if _can_copy_dep(dep_path):
-        _copy_project_file(dep_path, dep, state)
-    else:
-        _link_project_file(dep_path, dep, state)
+def _link_deps_enabled():
+    return os.getenv("DVC_LINK_DEPS") == "1"
 
 
-def _can_copy_dep(dep_path):
-    return os.path.isfile(dep_path)
+def _project_file_stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
 
 
-def _copy_project_file(src, dep, state):
+def _copy_project_file(src, dep, state, copies):
     dest = os.path.join(state.run_dir, dep)
     log.info("Copying %s", dep)
-    util.copyfile(src, dest)
+    copies.append((src, dest))
     print(f"##### DEP 2 {src} -> {dest}")
 
 
@@ -242,14 +244,19 @@ def _link_project_file(src, dep, state):
     print(f"##### DEP 3 {rel_src} -> {link}")
 
 
-def _pull_dep(dep, state):
-    log.info("Fetching %s", dep)
+def _pull_deps(deps, state):
+    if not deps:
+        return
+    for dep in deps:
+        log.info("Fetching %s", dep)
     try:
-        dvc_util.pull_dvc_dep(dep, state.run_dir, state.project_dir)
+        dvc_util.pull_dvc_deps(deps, state.run_dir, state.project_dir)
     except dvc_util.DvcPullError as e:
         raise SystemExit(str(e)) from e
     else:
-        state.manifest_entries.append(_dep_entry_for_pull(dep, state))
+        state.manifest_entries.extend(
+            _dep_entry_for_pull(dep, state) for dep in deps
+        )
 
 
 def _dep_entry_for_pull(dep, state):
@@ -262,6 +269,7 @@ def _dep_entry_for_pull(dep, state):
 
 
 def _copy_params_with_flags(state):
+    copies = []
     for name in _iter_stage_param_files(state):
         dest = os.path.join(state.run_dir, name)
         if os.path.exists(dest):
@@ -273,8 +281,54 @@ def _copy_params_with_flags(state):
                 f"directory {state.project_dir}"
             )
         log.info("Copying %s", name)
-        util.copyfile(src, dest)
+        copies.append((src, dest))
         print(f"##### DEP 5 {src} -> {dest}")
+    _copy_files(copies)
+
+
+def _copy_files(copies, link=False):
+    """Copies a list of `(src, dest)` files.
+
+    Files are copied using a thread pool when there's more than one
+    file to copy. Use `DVC_COPY_WORKERS` to set the number of threads
+    used. Set to `1` to copy files serially.
+
+    If `link` is True, files are hard linked when possible rather
+    than copied. Files are copied if they can't be linked (e.g. src
+    and dest are on different file systems).
+    """
+    copy = _link_or_copy_file if link else util.copyfile
+    workers = _copy_workers()
+    if workers <= 1 or len(copies) <= 1:
+        for src, dest in copies:
+            copy(src, dest)
+        return
+    # Copies are I/O bound and release the GIL - threads are suitable
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(lambda args: copy(*args), copies):
+            pass
+
+
+def _link_or_copy_file(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        util.copyfile(src, dest)
+
+
+def _copy_workers():
+    workers_env = os.getenv("DVC_COPY_WORKERS")
+    if workers_env:
+        try:
+            return int(workers_env)
+        except ValueError:
+            log.warning(
+                "invalid value for DVC_COPY_WORKERS %r - using default",
+                workers_env,
+            )
+    return min(32, (os.cpu_count() or 1) * 4)
 
 
 def _iter_stage_param_files(state):
@@ -282,9 +336,10 @@ def _iter_stage_param_files(state):
     for _param, filename in dvc_util.iter_stage_params(
         state.target_stage, state.dvc_config
     ):
-        if not filename in seen:
-            seen.add(filename)
-            yield filename
+        if filename in seen:
+            continue
+        seen.add(filename)
+        yield filename
 
 
 def _repro_run(state):
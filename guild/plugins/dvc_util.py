@@ -17,13 +17,14 @@ import logging
 import os
 import subprocess
 
-import yaml
-
 from guild import util
 from guild import var
+from guild import yaml_util
 
 log = logging.getLogger("guild")
 
+_dvc_config_cache = {}
+
 
 class DvcInitError(Exception):
     pass
@@ -34,16 +35,31 @@ class DvcPullError(Exception):
 
 
 def load_dvc_config(dir):
+    """Returns the DvC config defined in dir/dvc.yaml.
+
+    Configs are cached by path and are reloaded when the file inode,
+    modification time, or size changes. Callers must not modify the
+    returned config.
+    """
     yaml_filename = dvc_yaml_path(dir)
-    if not os.path.exists(yaml_filename):
+    try:
+        st = os.stat(yaml_filename)
+    except OSError:
         log.warning(
             "%s not found - skipping DvC stages import",
             os.path.relpath(yaml_filename),
         )
         return {}
+    cache_key = os.path.realpath(yaml_filename)
+    stamp = st.st_ino, st.st_mtime_ns, st.st_size
+    cached = _dvc_config_cache.get(cache_key)
+    if cached and cached[0] == stamp:
+        return cached[1]
     log.debug("loading %s for DvC stages import", yaml_filename)
-    with open(yaml_filename) as f:
-        return yaml.safe_load(f)
+    with open(yaml_filename, "rb") as f:
+        dvc_config = yaml_util.safe_load(f)
+    _dvc_config_cache[cache_key] = stamp, dvc_config
+    return dvc_config
 
 
 def dvc_yaml_path(dir):
@@ -282,8 +298,20 @@ def _ensure_dvc_tmpdir(run_dir, resolved_repo_paths):
 
 
 def pull_dvc_dep(dep, run_dir, project_dir, remote=None):
-    _ensure_dvc_file(dep, run_dir, project_dir)
-    return _pull_dep(dep, run_dir, remote)
+    return pull_dvc_deps([dep], run_dir, project_dir, remote)[0]
+
+
+def pull_dvc_deps(deps, run_dir, project_dir, remote=None):
+    """Pulls deps using a single call to `dvc pull`.
+
+    If the call fails, deps are pulled individually so that the error
+    names the dep that could not be fetched.
+
+    Returns a list of pulled dep paths in the same order as `deps`.
+    """
+    for dep in deps:
+        _ensure_dvc_file(dep, run_dir, project_dir)
+    return _pull_deps(deps, run_dir, remote)
 
 
 def _ensure_dvc_file(dep, run_dir, project_dir):
@@ -301,29 +329,43 @@ def _ensure_dvc_file(dep, run_dir, project_dir):
     util.copyfile(src, dest)
 
 
-def _pull_dep(dep, run_dir, remote=None):
-    cmd = ["dvc", "pull", dep]
-    if remote:
-        cmd.extend(["--remote", remote])
-    log.info("Fetching DvC resource %s", dep)
-    log.debug("dvc pull cmd: %s", cmd)
-    try:
-        subprocess.check_call(["dvc", "pull", dep], cwd=run_dir)
-    except subprocess.CalledProcessError as e:
-        if log.getEffectiveLevel() <= logging.DEBUG:
-            log.exception("cmd: %s", cmd)
-        raise DvcPullError(
-            f"error fetching DvC resource {dep}: 'dvc pull' exited with "
-            f"non-zero exit status {e.returncode} (see above for details)"
-        ) from e
-    else:
-        dep_path = os.path.join(run_dir, dep)
+def _pull_deps(deps, run_dir, remote=None):
+    if not deps:
+        return []
+    returncode = _dvc_pull(deps, run_dir, remote)
+    if returncode != 0:
+        if len(deps) == 1:
+            _raise_pull_error(deps[0], returncode)
+        # Pull each dep to attribute the failure to a specific dep
+        log.info("Fetching DvC resources individually")
+        for dep in deps:
+            returncode = _dvc_pull([dep], run_dir, remote)
+            if returncode != 0:
+                _raise_pull_error(dep, returncode)
+    dep_paths = [os.path.join(run_dir, dep) for dep in deps]
+    for dep, dep_path in zip(deps, dep_paths):
         if not os.path.exists(dep_path):
             raise DvcPullError(
                 f"'dvc pull' did not fetch the expected file {dep} "
                 "(see above for details)"
             )
-        return dep_path
+    return dep_paths
+
+
+def _dvc_pull(deps, run_dir, remote):
+    cmd = ["dvc", "pull", *deps]
+    if remote:
+        cmd.extend(["--remote", remote])
+    log.info("Fetching DvC resource %s", ", ".join(deps))
+    log.debug("dvc pull cmd: %s", cmd)
+    return subprocess.run(cmd, cwd=run_dir, check=False).returncode
+
+
+def _raise_pull_error(dep, returncode):
+    raise DvcPullError(
+        f"error fetching DvC resource {dep}: 'dvc pull' exited with "
+        f"non-zero exit status {returncode} (see above for details)"
+    )
 
 
 def iter_stage_metrics_data(stage, run_dir):
@@ -363,7 +405,8 @@ def _load_metrics(path):
 
 
 def _load_yaml(path):
-    return yaml.safe_load(open(path))
+    with open(path, "rb") as f:
+        return yaml_util.safe_load(f)
 
 
 def _load_json(path):
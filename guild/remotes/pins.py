@@ -1,10 +1,16 @@
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
 import logging
 import shutil
 import tempfile
 import os
+import re
 import zipfile
 import sys
-import pins
+import time
 from guild import remote as remotelib
 from guild import var
 from guild import remote_util
@@ -16,6 +22,10 @@ log = logging.getLogger("guild.remotes.pins")
 RUNS_PATH = ["runs"]
 DELETED_RUNS_PATH = ["trash", "runs"]
 
+_boards = {}
+
+_META_FILE_P = re.compile(r"\.guild/opref\Z|/\.guild/(?:attrs/|LOCK)")
+
 class PinsRemoteType(remotelib.RemoteType):
     def __init__(self, _ep):
         pass
@@ -30,15 +40,14 @@ class PinsRemote (meta_sync.MetaSyncRemote):
     def __init__(self, name, config):
         self.name = name
         board_config = config['config']
-        if board_config['board'] == "temp":
-            self.board = pins.board_temp()
-        elif board_config['board'] == 'folder':
-            self.board = pins.board_folder(board_config['path'])
-        else:
-            raise RuntimeError(f"Unsupported board configuration {board_config['path']}.")
+        board_key = json.dumps(board_config, sort_keys=True)
+        self.board = _board_for_config(board_config, board_key)
 
         self.local_env = remote_util.init_env(config.get("local-env"))
-        self.local_sync_dir = meta_sync.local_meta_dir(name, str(board_config))
+        self.compress = config.get("compress", False)
+        self.max_workers = config.get("max-workers", 8)
+        self.meta_ttl = config.get("meta-ttl", 0)
+        self.local_sync_dir = meta_sync.local_meta_dir(name, board_key)
         runs_dir = os.path.join(self.local_sync_dir, *RUNS_PATH)
         deleted_runs_dir = os.path.join(self.local_sync_dir, *DELETED_RUNS_PATH)
         super().__init__(runs_dir, deleted_runs_dir)
@@ -48,23 +57,82 @@ class PinsRemote (meta_sync.MetaSyncRemote):
 
     def _sync_runs_meta(self, force=False):
         remote_util.remote_activity(f"Refreshing run info for {self.name}")
-        runs = self.board.pin_search(as_df=True)
-        self._clear_runs_meta_dir()
-        for _, run in runs.iterrows():
-            meta_string = run.meta.user["guild_meta"]
-            with tempfile.NamedTemporaryFile(mode= "wb") as temp:
-                _ = temp.write(bytes(meta_string))
-                temp.flush()
-                with zipfile.ZipFile(temp.name, mode="r") as zip_ref:
-                    path = os.path.join(self._runs_dir, run["name"], "")
-                    zip_ref.extractall(path)
+        if not force and self._meta_manifest_fresh():
+            return
+        runs_meta = {
+            name: (hashlib.md5(meta).hexdigest(), meta)
+            for name, meta in self.batch_get_runs_meta().items()
+        }
+        manifest = self._read_meta_manifest()
+        if manifest is None or not os.path.isdir(self._runs_dir):
+            self._clear_runs_meta_dir()
+            manifest = {}
+        # Only extract meta for runs that are new or changed since the
+        # last sync and remove runs that no longer exist.
+        for name, digest in manifest.items():
+            if name not in runs_meta or runs_meta[name][0] != digest:
+                shutil.rmtree(os.path.join(self._runs_dir, name), ignore_errors=True)
+        changed = [
+            (name, meta) for name, (digest, meta) in runs_meta.items()
+            if manifest.get(name) != digest
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for _ in executor.map(self._extract_run_meta, changed):
+                pass
+        self._write_meta_manifest(
+            {name: digest for name, (digest, _meta) in runs_meta.items()}
+        )
+
+    def batch_get_runs_meta(self, run_ids=None):
+        """Returns a dict of run ID to archived run meta.
+
+        Meta for all runs is read with a single board search. If
+        `run_ids` is specified, only meta for those runs is returned.
+        """
+        if run_ids is not None:
+            run_ids = set(run_ids)
+        runs_meta = {}
+        for _, run in self.board.pin_search(as_df=True).iterrows():
+            name = run["name"]
+            if run_ids is None or name in run_ids:
+                runs_meta[name] = bytes(run.meta.user["guild_meta"])
+        return runs_meta
+
+    def _meta_manifest_fresh(self):
+        if not self.meta_ttl:
+            return False
+        try:
+            mtime = os.path.getmtime(self._meta_manifest_path())
+        except OSError:
+            return False
+        return time.time() - mtime < self.meta_ttl
+
+    def _meta_manifest_path(self):
+        return os.path.join(self.local_sync_dir, "meta-manifest.json")
+
+    def _read_meta_manifest(self):
+        try:
+            with open(self._meta_manifest_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta_manifest(self, manifest):
+        path = self._meta_manifest_path()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def _extract_run_meta(self, run_meta):
+        name, meta = run_meta
+        with zipfile.ZipFile(io.BytesIO(meta), mode="r") as zip_ref:
+            zip_ref.extractall(os.path.join(self._runs_dir, name, ""))
 
     def _clear_runs_meta_dir (self):
-        for root, dirs, files in os.walk(self._runs_dir):
-            for f in files:
-                os.unlink(os.path.join(root, f))
-            for d in dirs:
-                shutil.rmtree(os.path.join(root, d))
+        if os.path.isdir(self._runs_dir):
+            shutil.rmtree(self._runs_dir)
+        os.makedirs(self._runs_dir, exist_ok=True)
         
     def _purge_runs(self, runs):
         raise NotImplementedError("Pins doesn't support non permanent deletion of runs.")
@@ -74,51 +142,55 @@ class PinsRemote (meta_sync.MetaSyncRemote):
     
     def push(self, runs, delete = False):
         remote_util.remote_activity("Pushing runs to pins board...")
-        for run in runs:
-            self._push_run(run, delete)
-        self._sync_runs_meta()
+        self._map_runs(lambda run: self._push_run(run, delete), runs)
+        self._sync_runs_meta(force=True)
+
+    def _map_runs(self, f, runs):
+        # Runs are independent - apply f concurrently and raise the
+        # first error, if any, after all runs are processed.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(f, run) for run in runs]
+        for future in futures:
+            future.result()
 
     def _push_run(self, run, delete):
         with tempfile.TemporaryDirectory() as outdir:
             archive_path = self._archive_run_dir(run.path, outdir)
             metadata = self._archive_run_meta(run.path)
-            # TODO Currently pins doesn't support uploading files, so we read the archive into a binary
-            # string and use pin_write to upload it.
+            # TODO Currently pins doesn't support uploading files, so we read the archive into a
+            # base64 encoded string and use pin_write to upload it.
             with open(archive_path, mode="rb") as f:
-                data = list(f.read())
+                data = {"b64": base64.b64encode(f.read()).decode("ascii")}
             self.board.pin_write(data, type="json", name=run.id, versioned=True, metadata={"guild_meta": metadata})
 
-    def _archive_run_dir(self, dir, outfile):
-       return shutil.make_archive(outfile, 'zip', dir)
-    
+    def _archive_run_dir(self, dir, outdir):
+        return _archive_run_dir(dir, outdir, self.compress)
+
     def _archive_run_meta(self, run_path):
-        with tempfile.NamedTemporaryFile() as tmp:
-            with zipfile.ZipFile(tmp.name, "w") as zf:
-                for root, _, files in os.walk(run_path):
-                    for file in files:
-                        fname = os.path.join(root, file)
-                        relpath = os.path.relpath(fname, run_path)
-                        if _is_meta_file(fname):    
-                            zf.write(fname, relpath)
-            # now read the zip file into a bytestring
-            with open(tmp.name, "rb") as f:
-                data = f.read()
-            return data
-        
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+            prefix_len = len(os.path.join(run_path, ""))
+            for root, _, files in os.walk(run_path):
+                root_prefix = os.path.join(root, "")
+                for file in files:
+                    fname = root_prefix + file
+                    if _is_meta_file(fname):
+                        zf.write(fname, fname[prefix_len:])
+        return buf.getvalue()
+
     def pull(self, runs, delete=False):
-        for run in runs:
-            self._pull_run(run, delete)
+        self._map_runs(lambda run: self._pull_run(run, delete), runs)
 
     def _pull_run(self, run, delete):
         if delete:
             raise ValueError("Unsupported delete op.")
-        archive = self.board.pin_read(run.id)
-        with tempfile.NamedTemporaryFile(mode= "wb") as temp:
-            _ = temp.write(bytes(archive))
-            with zipfile.ZipFile(temp.name, mode="r") as zip_ref:
-                    zip_ref.extractall(os.path.join(var.runs_dir(), run.id, ""))
+        archive = _decode_run_archive(self.board.pin_read(run.id))
+        with zipfile.ZipFile(io.BytesIO(archive), mode="r") as zip_ref:
+            zip_ref.extractall(os.path.join(var.runs_dir(), run.id, ""))
 
     def _delete_runs(self, runs, permanent):
+        import pins
+
         for run in runs:
             if not permanent:
                 log.warning("Deleting pins runs is always permanent. Nothing will be deleted.")
@@ -130,8 +202,52 @@ class PinsRemote (meta_sync.MetaSyncRemote):
             except:
                 log.warning("Failed to delete run %s. Unknown error", run.id)
             
+def _board_for_config(board_config, board_key):
+    # Boards are shared across remotes with the same config so that
+    # any connection state is reused within a process. Temp boards
+    # are always created new.
+    import pins
+
+    if board_config['board'] == "temp":
+        return pins.board_temp()
+    try:
+        return _boards[board_key]
+    except KeyError:
+        pass
+    if board_config['board'] == 'folder':
+        board = pins.board_folder(board_config['path'])
+    else:
+        raise RuntimeError(f"Unsupported board configuration {board_config['path']}.")
+    _boards[board_key] = board
+    return board
+
+def _archive_run_dir(dir, outdir, compress=False):
+    archive_path = os.path.join(outdir, "run.zip")
+    # Run files are often already compressed (images, model weights, etc.)
+    # so archives are stored without compression unless configured.
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(archive_path, "w", compression, compresslevel=1) as zf:
+        # Paths under dir share its prefix - slice rather than use relpath
+        prefix_len = len(os.path.join(dir, ""))
+        for root, dirs, files in os.walk(dir):
+            root_prefix = os.path.join(root, "")
+            for name in dirs:
+                path = root_prefix + name
+                zf.write(path, path[prefix_len:])
+            for name in files:
+                path = root_prefix + name
+                # Skip broken links and special files (e.g. named pipes)
+                if os.path.isfile(path):
+                    zf.write(path, path[prefix_len:])
+    return archive_path
+
+def _decode_run_archive(archive):
+    # Runs pushed by earlier versions are stored as a list of byte values
+    if isinstance(archive, dict):
+        return base64.b64decode(archive["b64"])
+    return bytes(archive)
+
 def _is_meta_file(name):
-    return (
-        name.endswith(".guild/opref") or "/.guild/attrs/" in name
-        or "/.guild/LOCK" in name
-    )
+    # Most run files aren't under .guild - reject them before the
+    # regex search
+    return ".guild/" in name and _META_FILE_P.search(name) is not None
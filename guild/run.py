@@ -12,19 +12,43 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+import locale
 import os
 import random
+import re
 import threading
 import time
 
 import uuid
-import yaml
 
 from guild import opref as opreflib
 from guild import util
 from guild import yaml_util
 
 
+_MISSING_ATTR = object()
+
+# Attrs dir mtimes more recent than this may not reflect a write made
+# in the same file system clock tick
+_MISSING_ATTR_MIN_DIR_AGE_NS = 1_000_000_000
+
+_ATTR_TMP_SUFFIX = ".tmp"
+
+_ATTR_REPLACE_RETRY_DELAYS = (0.01, 0.05, 0.1)
+
+_ATTR_SCALAR_VALS = {
+    "true": True,
+    "false": False,
+    "null": None,
+}
+_ATTR_INT_P = re.compile(r"-?(?:0|[1-9][0-9]*)")
+_ATTR_FLOAT_P = re.compile(r"-?(?:0|[1-9][0-9]*)\.[0-9]+(?:e[-+][0-9]+)?")
+_ATTR_STR_P = re.compile(r"[A-Za-z_][A-Za-z0-9_./-]*")
+_YAML_RESERVED_WORDS = {"true", "false", "yes", "no", "on", "off", "null"}
+_YAML_STRICT_BOOL_CHARS = {"y", "Y", "n", "N"}
+
+
 class Run:
     __properties__ = [
         "id",
@@ -40,7 +64,13 @@ class Run:
         self.id = id
         self.path = path
         self._guild_dir = os.path.join(self.path, ".guild")
+        # Precompute paths used to read attrs and status
+        self._attrs_dir_path = os.path.join(self._guild_dir, "attrs")
+        self._attr_path_prefix = self._attrs_dir_path + os.path.sep
+        self._lock_path = os.path.join(self._guild_dir, "LOCK")
+        self._remote_lock_path = os.path.join(self._guild_dir, "LOCK.remote")
         self._opref = None
+        self._attr_cache = {}
         self._props = util.PropertyCache(
             [
                 ("timestamp", None, self._get_timestamp, 1.0),
@@ -92,31 +122,31 @@ class Run:
         return self._props.get("pid")
 
     def _get_pid(self):
-        lockfile = self.guild_path("LOCK")
         try:
-            raw = open(lockfile, "r").read(10)
-        except (IOError, ValueError):
+            with open(self._lock_path, "r") as f:
+                raw = f.read(16)
+        except (OSError, ValueError):
+            return None
+        try:
+            return int(raw)
+        except ValueError:
             return None
-        else:
-            try:
-                return int(raw)
-            except ValueError:
-                return None
 
     @property
     def status(self):
-        if os.path.exists(self.guild_path("LOCK.remote")):
+        # List guild dir once rather than check for each status file
+        guild_files = set(util.safe_listdir(self._guild_dir))
+        if "LOCK.remote" in guild_files:
             return "running"
-        if os.path.exists(self.guild_path("PENDING")):
+        if "PENDING" in guild_files:
             return "pending"
-        if os.path.exists(self.guild_path("STAGED")):
+        if "STAGED" in guild_files:
             return "staged"
-        return self._local_status()
+        return self._local_status("LOCK" in guild_files)
 
     @property
     def remote(self):
-        remote_lock_path = self.guild_path("LOCK.remote")
-        return util.try_read(remote_lock_path, apply=str.strip)
+        return util.try_read(self._remote_lock_path, apply=str.strip)
 
     @property
     def timestamp(self):
@@ -139,10 +169,12 @@ class Run:
             return for_dir(proto_dir)
         return None
 
-    def _local_status(self):
+    def _local_status(self, has_lock):
         exit_status = self.get("exit_status")
         if exit_status is not None:
             return _status_for_exit_status(exit_status)
+        if not has_lock:
+            return "error"
         local_pid = self._get_pid()
         if local_pid is not None and util.pid_exists(local_pid):
             return "running"
@@ -157,7 +189,11 @@ class Run:
             return val if val is not None else default
 
     def attr_names(self):
-        return sorted(util.safe_listdir(self._attrs_dir()))
+        return sorted(
+            name
+            for name in util.safe_listdir(self._attrs_dir())
+            if not name.endswith(_ATTR_TMP_SUFFIX)
+        )
 
     def has_attr(self, name):
         return os.path.exists(self._attr_path(name))
@@ -170,24 +206,64 @@ class Run:
                 pass
 
     def __getitem__(self, name):
+        """Returns the value of attr `name`.
+
+        Values are cached and reread when the attr file inode,
+        modification time, or size changes. Missing attrs are cached
+        until the attrs dir modification time changes.
+        """
+        cached = self._attr_cache.get(name)
+        if cached and cached[0] is _MISSING_ATTR:
+            if cached[1] == self._attrs_dir_mtime_ns():
+                raise KeyError(name)
+        path = self._attr_path(name)
         try:
-            f = open(self._attr_path(name), "r")
-        except IOError as e:
+            st = os.stat(path)
+        except OSError as e:
+            self._cache_missing_attr(name)
             raise KeyError(name) from e
-        else:
-            return yaml.safe_load(f)
+        stamp = st.st_ino, st.st_mtime_ns, st.st_size
+        if cached and cached[0] == stamp:
+            return _copy_attr_val(cached[1])
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            raise KeyError(name) from e
+        val = _decode_attr(_attr_text(data))
+        self._attr_cache[name] = stamp, val
+        return _copy_attr_val(val)
+
+    def _attrs_dir_mtime_ns(self):
+        try:
+            return os.stat(self._attrs_dir_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _cache_missing_attr(self, name):
+        # Attrs are written with `os.replace`, which updates the attrs
+        # dir mtime. Skip caching when the mtime is too recent to
+        # reliably detect a subsequent write.
+        mtime_ns = self._attrs_dir_mtime_ns()
+        if (
+            mtime_ns is None
+            or time.time_ns() - mtime_ns < _MISSING_ATTR_MIN_DIR_AGE_NS
+        ):
+            self._attr_cache.pop(name, None)
+            return
+        self._attr_cache[name] = _MISSING_ATTR, mtime_ns
 
     def _attr_path(self, name):
-        return os.path.join(self._attrs_dir(), name)
+        return self._attr_path_prefix + name
 
     def _attrs_dir(self):
-        return os.path.join(self._guild_dir, "attrs")
+        return self._attrs_dir_path
 
     def __repr__(self):
         return f"<{self.__class__.__module__}.{self.__class__.__name__} '{self.id}'>"
 
     def init_skel(self):
-        util.ensure_dir(self.guild_path("attrs"))
+        util.ensure_dir(self._attrs_dir_path)
         if not self.has_attr("initialized"):
             self.write_attr("id", self.id)
             self.write_attr("initialized", timestamp())
@@ -199,29 +275,28 @@ class Run:
 
     def write_attr(self, name, val, raw=False):
         if not raw:
-            val = yaml_util.encode_yaml(val, strict=True)
-        with open(self._attr_path(name), "w") as f:
-            f.write(val)
-            f.write(os.linesep)
-            f.close()
+            val = _encode_attr(val)
+        path = self._attr_path(name)
+        # Temp file names are unique per writer so that concurrent
+        # writes of the same attr don't replace each other's temp file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}{_ATTR_TMP_SUFFIX}"
+        _write_attr_file(tmp, val)
+        # Replace to avoid leaving a partially written attr
+        if not _replace_attr_file(tmp, path):
+            # Attr is open by another process (Windows) - write in place
+            _write_attr_file(path, val)
+        self._attr_cache.pop(name, None)
 
     def del_attr(self, name):
+        self._attr_cache.pop(name, None)
         try:
             os.remove(self._attr_path(name))
         except OSError:
             pass
 
     def iter_files(self, all_files=False, follow_links=False):
-        for root, dirs, files in os.walk(self.path, followlinks=follow_links):
-            if not all_files and root == self.path:
-                try:
-                    dirs.remove(".guild")
-                except ValueError:
-                    pass
-            for name in dirs:
-                yield os.path.join(root, name)
-            for name in files:
-                yield os.path.join(root, name)
+        exclude = () if all_files else (".guild",)
+        return _iter_dir_files(self.path, follow_links, exclude)
 
     def iter_guild_files(self, subpath):
         guild_path = self.guild_path(subpath)
@@ -236,6 +311,141 @@ class Run:
                     yield os.path.join(rel_root, name)
 
 
+def _encode_attr(val):
+    """Returns val encoded for an attr file.
+
+    Simple scalars are encoded without YAML using the same format as
+    `yaml_util.encode_yaml`. Other values are encoded using YAML.
+    """
+    val_type = type(val)
+    if val is None:
+        return "null"
+    if val_type is bool:
+        return "true" if val else "false"
+    if val_type is int:
+        return str(val)
+    if val_type is float:
+        return _encode_float_attr(val)
+    if (
+        val_type is str
+        and _ATTR_STR_P.fullmatch(val)
+        and val.lower() not in _YAML_RESERVED_WORDS
+        and val not in _YAML_STRICT_BOOL_CHARS
+    ):
+        return val
+    return yaml_util.encode_yaml(val, strict=True)
+
+
+def _encode_float_attr(val):
+    # Follows PyYAML SafeRepresenter.represent_float
+    if val != val:
+        return ".nan"
+    if val == float("inf"):
+        return ".inf"
+    if val == float("-inf"):
+        return "-.inf"
+    encoded = repr(val).lower()
+    if "." not in encoded and "e" in encoded:
+        encoded = encoded.replace("e", ".0e", 1)
+    return encoded
+
+
+def _attr_text(data):
+    # Attrs are read as bytes to avoid the overhead of text mode. Use
+    # the text mode encoding for non-ASCII values.
+    if data.isascii():
+        return data.decode("ascii")
+    return data.decode(locale.getpreferredencoding(False))
+
+
+def _decode_attr(s):
+    """Returns the decoded value of an attr file.
+
+    Attrs are typically simple scalars. These are decoded without
+    YAML, which is relatively slow. Anything else is decoded using
+    YAML.
+    """
+    stripped = s.strip()
+    if stripped in _ATTR_SCALAR_VALS:
+        return _ATTR_SCALAR_VALS[stripped]
+    if _ATTR_INT_P.fullmatch(stripped):
+        return int(stripped)
+    if _ATTR_FLOAT_P.fullmatch(stripped):
+        return float(stripped)
+    if (
+        _ATTR_STR_P.fullmatch(stripped)
+        and stripped.lower() not in _YAML_RESERVED_WORDS
+    ):
+        return stripped
+    return yaml_util.safe_load(s)
+
+
+def _iter_dir_files(root, follow_links, exclude=()):
+    # Yields paths in the same order as `os.walk` using `os.scandir`
+    # entry types to avoid additional stat calls.
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return
+    dirs = []
+    files = []
+    for entry in entries:
+        if entry.name in exclude:
+            continue
+        if util.safe_is_dir(entry):
+            dirs.append(entry)
+        else:
+            files.append(entry)
+    for entry in dirs:
+        yield entry.path
+    for entry in files:
+        yield entry.path
+    for entry in dirs:
+        if follow_links or not entry.is_symlink():
+            yield from _iter_dir_files(entry.path, follow_links)
+
+
+def _write_attr_file(path, val):
+    with open(path, "w") as f:
+        f.write(val)
+        f.write(os.linesep)
+
+
+def _replace_attr_file(tmp, path):
+    """Replaces path with tmp.
+
+    On Windows, replace fails with a permission error while another
+    process has path open. Replace is retried briefly in this case.
+
+    Returns True if path is replaced, otherwise removes tmp and returns
+    False.
+    """
+    replaced = False
+    try:
+        for delay in _ATTR_REPLACE_RETRY_DELAYS + (None,):
+            try:
+                os.replace(tmp, path)
+            except PermissionError:
+                if delay is None:
+                    break
+                time.sleep(delay)
+            else:
+                replaced = True
+                break
+    finally:
+        if not replaced:
+            util.ensure_deleted(tmp)
+    return replaced
+
+
+def _copy_attr_val(val):
+    # Cached values are shared - copy mutable values so callers can't
+    # modify them
+    if isinstance(val, (dict, list)):
+        return copy.deepcopy(val)
+    return val
+
+
 def _status_for_exit_status(exit_status):
     assert exit_status is not None, exit_status
     if exit_status == 0:
@@ -254,7 +464,7 @@ def timestamp():
 
     Ensures that subsequent calls return increasing values.
     """
-    ts = int(time.time() * 1000000)
+    ts = time.time_ns() // 1000
     with __last_ts_lock:
         if __last_ts is not None and __last_ts >= ts:
             ts = __last_ts + 1
@@ -1421,6 +1421,13 @@ def safe_listdir(path):
         return []
 
 
+def safe_is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
 def compare_paths(p1, p2):
     return _resolve_path(p1) == _resolve_path(p2)
 
@@ -428,7 +428,7 @@ class _GitignoreSelectRule(FileSelectRule):
     def __str__(self):
         return "gitignore + guildignore patterns"
 
-    def test(self, _src_root, relpath):
+    def test(self, _src_root, relpath, _context=None):
         # This is a 'select everything except ignored' rule so we
         # return `True` to select anything that isn't in our list of
         # ignored. This could alternatively be a `False` for anything
@@ -17,6 +17,11 @@ import re
 
 import yaml
 
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
 
 def encode_yaml(val, default_flow_style=False, strict=False):
     """Returns val encoded as YAML.
@@ -45,6 +50,16 @@ def _strip_encoded_yaml(encoded):
     return stripped
 
 
+def safe_load(stream):
+    """Loads YAML from stream using the libyaml safe loader if available.
+
+    Use in place of `yaml.safe_load` for large documents. Falls back on
+    the pure Python safe loader when PyYAML is installed without libyaml
+    bindings.
+    """
+    return yaml.load(stream, Loader=_SafeLoader)
+
+
 def decode_yaml(s):
     try:
         return yaml.safe_load(s)